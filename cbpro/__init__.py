@@ -3,3 +3,4 @@ from cbpro.public_client import PublicClient
 from cbpro.websocket_client import WebsocketClient
 from cbpro.order_book import OrderBook
 from cbpro.cbpro_auth import CBProAuth
+from cbpro.rate_limiter import CircuitOpen
@@ -0,0 +1,499 @@
+#
+# cbpro/AsyncPublicClient.py
+#
+# For concurrent public requests to the Coinbase exchange using asyncio
+
+import asyncio
+import collections
+import sys
+
+import aiohttp
+
+from cbpro.public_client import (PaginationCursor, _NUMERIC_CONVERTERS,
+                                 _candles_to_numpy, _convert_numbers,
+                                 _historic_rates_params, _loads,
+                                 _product_endpoint)
+from cbpro.rate_limiter import (RETRY_STATUSES, CircuitBreaker, TokenBucket,
+                                backoff_delay, parse_retry_after)
+
+
+def uvloop_factory():
+    """Get an event loop factory for uvloop, if uvloop is available.
+
+    uvloop dispatches socket readiness events considerably faster than the
+    default selector loop. The loop has to be chosen before it is created,
+    so this is left to the application rather than done implicitly by the
+    client::
+
+        with asyncio.Runner(loop_factory=uvloop_factory()) as runner:
+            runner.run(main())
+
+    Returns:
+        callable: `uvloop.new_event_loop`, or None (meaning the asyncio
+            default) if uvloop is not installed or not supported here.
+
+    """
+    if sys.platform == 'win32':
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop.new_event_loop
+
+
+class _Microbatcher(object):
+    """Coalesces calls arriving within a short window into one batch.
+
+    Each `submit` returns a future. The first submission starts a timer;
+    when it fires, the distinct keys submitted so far are passed to `fn`
+    in one call and every waiting future is resolved with the result for
+    its key. Batches belong to the event loop they were submitted on; a
+    batch left behind by a loop that has ended is dropped.
+
+    Args:
+        window_ms (float): How long to wait for more calls to coalesce.
+        fn (coroutine function): Called with a list of unique keys and
+            returning a list of results (or exceptions) in the same order.
+
+    """
+
+    def __init__(self, window_ms, fn):
+        self.window = window_ms / 1000.0
+        self.fn = fn
+        self._loop = None
+        self._pending = collections.deque()
+        self._timer = None
+        # Keep running batches referenced so they aren't garbage collected.
+        self._tasks = set()
+
+    def submit(self, key):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # The timer of a previous loop may never fire, and its futures
+            # can't be resolved from this one.
+            if self._timer is not None:
+                self._timer.cancel()
+            self._loop = loop
+            self._pending = collections.deque()
+            self._timer = None
+            self._tasks = set()
+        future = loop.create_future()
+        self._pending.append((key, future))
+        if self._timer is None:
+            self._timer = loop.call_later(self.window, self._fire)
+        return future
+
+    def _fire(self):
+        self._timer = None
+        batch, self._pending = self._pending, collections.deque()
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        keys = list(collections.OrderedDict.fromkeys(key for key, _ in batch))
+        try:
+            results = dict(zip(keys, await self.fn(keys)))
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            results = dict.fromkeys(keys, e)
+        for key, future in batch:
+            # The caller may have been cancelled while waiting.
+            if future.done():
+                continue
+            result = results[key]
+            if isinstance(result, asyncio.CancelledError):
+                future.cancel()
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class _Page(object):
+    """A page of a paginated endpoint being fetched in the background.
+
+    The rate limiter token for the page has already been taken; the
+    request is sent once `delay` seconds have passed.
+
+    """
+    __slots__ = ('after', 'sent', 'task')
+
+    def __init__(self, client, url, params, after, delay=0.0):
+        self.after = after
+        self.sent = False
+        self.task = asyncio.ensure_future(
+            self._fetch(client, url, dict(params, after=after), delay))
+
+    async def _fetch(self, client, url, params, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.sent = True
+        return await client._get_page(url, params, prepaid=True)
+
+
+class AsyncPublicClient(object):
+    """cbpro public client API built on asyncio and aiohttp (or httpx).
+
+    Mirrors `PublicClient`, but every endpoint method is a coroutine so
+    that many requests can be in flight at once, e.g. with
+    `asyncio.gather`. The client must be used as an async context
+    manager so the underlying HTTP session is opened and closed::
+
+        async with AsyncPublicClient() as client:
+            tickers = await client.gather_tickers(['BTC-USD', 'ETH-USD'])
+
+    With `http2=True` the transport is an HTTP/2 `httpx.AsyncClient`,
+    which multiplexes concurrent requests over one or two connections
+    instead of opening one connection per in-flight request.
+
+    Attributes:
+        url (Optional[str]): API URL. Defaults to cbpro API.
+        session (aiohttp.ClientSession or httpx.AsyncClient): Persistent
+            HTTP connection pool. Only available inside the `async with`
+            block.
+        bucket (TokenBucket): Rate limiter shared by every request made
+            through this client.
+        breaker (CircuitBreaker): Stops sending requests for a while
+            after repeated failures.
+
+    """
+
+    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30,
+                 rate=3, burst=6, max_retries=5, numeric='str', http2=False,
+                 ticker_batch_ms=20):
+        """Create cbpro API async public client.
+
+        Args:
+            api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float or tuple]): Total request timeout in
+                seconds, or a (connect, read) tuple. Default is 30.
+            rate (Optional[float]): Requests per second allowed by the
+                client-side rate limiter. Default is 3.
+            burst (Optional[int]): Requests that may be sent at once
+                before `rate` applies. Default is 6.
+            max_retries (Optional[int]): Times a rate limited or failed
+                request is retried before its response is returned.
+                Default is 5.
+            numeric (Optional[str]): How numeric fields such as prices
+                and sizes are returned: 'str' (as sent by the API, the
+                default), 'float' or 'decimal'.
+            http2 (Optional[bool]): Use HTTP/2 through httpx instead of
+                aiohttp. Requires `httpx[http2]`. Default is False.
+            ticker_batch_ms (Optional[float]): Window in milliseconds in
+                which concurrent `get_product_ticker` calls are coalesced
+                into one batch of requests, with duplicate products
+                fetched once. Default is 20; 0 disables batching.
+
+        """
+        if numeric not in _NUMERIC_CONVERTERS:
+            raise ValueError('numeric must be one of {}'.format(
+                sorted(_NUMERIC_CONVERTERS)))
+        self.url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.http2 = http2
+        self.session = None
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        # Exceptions that mean the API could not be reached.
+        self._transport_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.max_retries = max_retries
+        self._convert = _NUMERIC_CONVERTERS[numeric]
+        self._ticker_batcher = None
+        if ticker_batch_ms:
+            self._ticker_batcher = _Microbatcher(
+                ticker_batch_ms, self._fetch_tickers_parallel)
+
+    async def __aenter__(self):
+        if self.http2:
+            import httpx
+            if isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+                timeout = httpx.Timeout(None, connect=connect, read=read)
+            else:
+                timeout = httpx.Timeout(self.timeout)
+            limits = httpx.Limits(max_connections=16,
+                                  max_keepalive_connections=16)
+            self.session = httpx.AsyncClient(http2=True, limits=limits,
+                                             timeout=timeout)
+            self._transport_errors = (httpx.HTTPError, asyncio.TimeoutError)
+        else:
+            if isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+                timeout = aiohttp.ClientTimeout(connect=connect,
+                                                sock_read=read)
+            else:
+                timeout = aiohttp.ClientTimeout(total=self.timeout)
+            connector = aiohttp.TCPConnector(limit_per_host=64,
+                                             keepalive_timeout=75)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying HTTP session."""
+        if self.session is not None:
+            if self.http2:
+                await self.session.aclose()
+            else:
+                await self.session.close()
+            self.session = None
+
+    async def get_products(self):
+        """Get a list of available currency pairs for trading.
+
+        See `PublicClient.get_products`.
+
+        """
+        return await self._send_message('get', '/products')
+
+    async def get_product_order_book(self, product_id, level=1):
+        """Get a list of open orders for a product.
+
+        See `PublicClient.get_product_order_book`.
+
+        """
+        params = {'level': level}
+        return await self._send_message('get',
+                                        _product_endpoint(product_id, '/book'),
+                                        params=params)
+
+    async def get_product_ticker(self, product_id):
+        """Snapshot about the last trade (tick), best bid/ask and 24h volume.
+
+        See `PublicClient.get_product_ticker`. Calls made at nearly the
+        same time are batched; callers asking for the same product share
+        one response object.
+
+        """
+        if self._ticker_batcher is None:
+            return await self._send_message(
+                'get', _product_endpoint(product_id, '/ticker'))
+        return await self._ticker_batcher.submit(product_id)
+
+    async def _fetch_tickers_parallel(self, product_ids):
+        return await asyncio.gather(
+            *(self._send_message('get', _product_endpoint(p, '/ticker'))
+              for p in product_ids),
+            return_exceptions=True)
+
+    async def gather_tickers(self, product_ids):
+        """Fetch the tickers for several products concurrently.
+
+        Args:
+            product_ids (list): Products
+
+        Returns:
+            list: Ticker info for each product, in the order given.
+
+        """
+        return await asyncio.gather(
+            *(self.get_product_ticker(p) for p in product_ids))
+
+    def get_product_trades(self, product_id, before='', after='', limit=None,
+                           result=None):
+        """List the latest trades for a product.
+
+        This method returns an async generator which may make multiple
+        HTTP requests while iterating through it with `async for`.
+
+        See `PublicClient.get_product_trades`.
+
+        """
+        return self._send_paginated_message(
+            _product_endpoint(product_id, '/trades'))
+
+    async def get_product_historic_rates(self, product_id, start=None,
+                                         end=None, granularity=None,
+                                         as_numpy=False):
+        """Historic rates for a product.
+
+        See `PublicClient.get_product_historic_rates`.
+
+        """
+        params = _historic_rates_params(start, end, granularity)
+        candles = await self._send_message(
+            'get', _product_endpoint(product_id, '/candles'), params=params)
+        if as_numpy:
+            return _candles_to_numpy(candles)
+        return candles
+
+    async def get_product_24hr_stats(self, product_id):
+        """Get 24 hr stats for the product.
+
+        See `PublicClient.get_product_24hr_stats`.
+
+        """
+        return await self._send_message(
+            'get', _product_endpoint(product_id, '/stats'))
+
+    async def get_currencies(self):
+        """List known currencies.
+
+        See `PublicClient.get_currencies`.
+
+        """
+        return await self._send_message('get', '/currencies')
+
+    async def get_time(self):
+        """Get the API server time.
+
+        See `PublicClient.get_time`.
+
+        """
+        return await self._send_message('get', '/time')
+
+    async def _send_message(self, method, endpoint, params=None, data=None):
+        """Send API request.
+
+        Args:
+            method (str): HTTP method (get, post, delete, etc.)
+            endpoint (str): Endpoint (to be added to base URL)
+            params (Optional[dict]): HTTP request parameters
+            data (Optional[str]): JSON-encoded string payload for POST
+
+        Returns:
+            dict/list: JSON response
+
+        """
+        url = self.url + endpoint
+        results, _ = await self._request_with_retry(method, url,
+                                                    params=params, data=data)
+        return results
+
+    async def _send_paginated_message(self, endpoint, params=None,
+                                      prefetch=4):
+        """ Send API message that results in a paginated response.
+
+        See `PublicClient._send_paginated_message`.
+
+        Cursors returned in `cb-after` are integer indices that decrease
+        by `limit` from page to page, so once the first page is known up
+        to `prefetch` further pages are requested concurrently and
+        yielded in order. If a page reports a cursor other than the
+        predicted one, the speculative requests are cancelled and
+        pagination continues from the real cursor.
+
+        The token for the page needed next is reserved before any
+        speculative page is started, and speculative pages only use
+        tokens that are available right away, so prefetching never
+        delays other requests. Tokens of pages cancelled before being
+        sent are returned.
+
+        Args:
+            endpoint (str): Endpoint (to be added to base URL)
+            params (Optional[dict]): HTTP request parameters
+            prefetch (Optional[int]): Maximum number of pages to request
+                ahead of the next one. 0 disables prefetching.
+
+        Yields:
+            dict: API response objects
+
+        """
+        if params is None:
+            params = dict()
+        url = self.url + endpoint
+        cursor = PaginationCursor(params)
+        results, cb_after = await self._get_page(url, params)
+        stride = cursor.limit or len(results) or 1
+        window = collections.deque()
+        try:
+            while True:
+                for result in results:
+                    yield result
+                # A short page is the last one.
+                if not cursor.advance(cb_after) or len(results) < stride:
+                    break
+                if window and window[0].after != cb_after:
+                    self._cancel_pages(window)
+                if not window:
+                    window.append(_Page(self, url, params, cb_after,
+                                        delay=self.bucket.reserve()))
+                while len(window) <= prefetch and window[-1].after.isdigit():
+                    after = int(window[-1].after) - stride
+                    if after <= 0 or not self.bucket.try_acquire():
+                        break
+                    window.append(_Page(self, url, params, str(after)))
+                results, cb_after = await window.popleft().task
+        finally:
+            self._cancel_pages(window)
+
+    def _cancel_pages(self, window):
+        while window:
+            page = window.popleft()
+            page.task.cancel()
+            if not page.sent:
+                self.bucket.refund()
+
+    async def _get_page(self, url, params, prepaid=False):
+        """Fetch one page of a paginated endpoint.
+
+        Returns:
+            tuple: Decoded JSON results and the `cb-after` cursor (or
+                None if there are no more pages).
+
+        """
+        results, headers = await self._request_with_retry(
+            'get', url, params=params, prepaid=prepaid)
+        return results, headers.get('cb-after')
+
+    async def _request_with_retry(self, method, url, prepaid=False,
+                                  **kwargs):
+        """Send a rate limited HTTP request, retrying transient failures.
+
+        See `PublicClient._request_with_retry`. If `prepaid`, the rate
+        limiter token for the first attempt has already been taken.
+
+        Returns:
+            tuple: Decoded JSON body and headers of the first
+                non-retriable response, or of the last response once
+                `max_retries` is exhausted.
+
+        Raises:
+            CircuitOpen: If too many recent calls have failed.
+
+        """
+        self.breaker.before_request()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt or not prepaid:
+                    await asyncio.sleep(self.bucket.reserve())
+                status, headers, body = await self._fetch(method, url,
+                                                          **kwargs)
+                if (attempt == self.max_retries or
+                        status not in RETRY_STATUSES or
+                        (status != 429 and method.lower() != 'get')):
+                    self.breaker.record(status not in RETRY_STATUSES)
+                    result = _loads(body)
+                    if self._convert is not None:
+                        result = _convert_numbers(result, self._convert)
+                    return result, headers
+                delay = parse_retry_after(headers)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                await asyncio.sleep(delay)
+        except self._transport_errors:
+            self.breaker.record(False)
+            raise
+
+    async def _fetch(self, method, url, params=None, data=None):
+        """Send one HTTP request over whichever transport is in use.
+
+        Returns:
+            tuple: Status code, headers and raw body of the response.
+
+        """
+        if self.http2:
+            r = await self.session.request(method, url, params=params,
+                                           content=data)
+            return r.status_code, r.headers, r.content
+        async with self.session.request(method, url, params=params,
+                                        data=data) as r:
+            return r.status, r.headers, await r.read()
@@ -7,7 +7,6 @@
 import hmac
 import hashlib
 import time
-import requests
 import base64
 import json
 from requests.auth import AuthBase
@@ -27,7 +26,8 @@ class AuthenticatedClient(PublicClient):
         session (requests.Session): Persistent HTTP connection object.
     """
     def __init__(self, key, b64secret, passphrase,
-                 api_url="https://api.pro.coinbase.com"):
+                 api_url="https://api.pro.coinbase.com", timeout=30, rate=5,
+                 burst=10):
         """ Create an instance of the AuthenticatedClient class.
 
         Args:
@@ -35,10 +35,22 @@ class AuthenticatedClient(PublicClient):
             b64secret (str): The secret key matching your API key.
             passphrase (str): Passphrase chosen when setting up key.
             api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float or tuple]): Request timeout in
+                seconds, or a (connect, read) tuple. Default is 30.
+            rate (Optional[float]): Requests per second allowed by the
+                client-side rate limiter. Default is 5, the private
+                endpoint limit.
+            burst (Optional[int]): Requests that may be sent at once
+                before `rate` applies. Default is 10.
         """
-        super(AuthenticatedClient, self).__init__(api_url)
+        super(AuthenticatedClient, self).__init__(api_url, timeout=timeout,
+                                                  rate=rate, burst=burst)
         self.auth = CBProAuth(key, b64secret, passphrase)
-        self.session = requests.Session()
+
+    def _request_with_retry(self, method, url, **kwargs):
+        kwargs['auth'] = self.auth
+        return super(AuthenticatedClient, self)._request_with_retry(
+            method, url, **kwargs)
 
     def get_account(self, account_id):
         """ Get information for a single account.
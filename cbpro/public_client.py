@@ -4,7 +4,166 @@
 #
 # For public requests to the Coinbase exchange
 
+import copy
+import functools
+import time
+from decimal import Decimal
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+from cbpro.rate_limiter import (RETRY_STATUSES, CircuitBreaker, TokenBucket,
+                                backoff_delay, parse_retry_after)
+
+_ACCEPTED_GRANS = frozenset((60, 300, 900, 3600, 21600, 86400))
+
+# Fields the API encodes as strings to preserve precision.
+_NUMERIC_FIELDS = frozenset((
+    'price', 'size', 'bid', 'ask', 'volume', 'open', 'high', 'low', 'last',
+    'volume_30day', 'base_min_size', 'base_max_size', 'base_increment',
+    'quote_increment', 'min_market_funds', 'max_market_funds', 'min_size',
+    'max_precision',
+))
+
+_NUMERIC_CONVERTERS = {'str': None, 'float': float, 'decimal': Decimal}
+
+ACCEPT_ENCODING = make_headers(accept_encoding=True)['accept-encoding']
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+@functools.lru_cache(maxsize=512)
+def _product_endpoint(product_id, suffix):
+    """Build (and memoize) the endpoint for a per-product resource."""
+    return '/products/{}{}'.format(product_id, suffix)
+
+
+def _historic_rates_params(start, end, granularity):
+    """Build the request parameters of a historic rates (candles) request.
+
+    Raises:
+        ValueError: If `granularity` is not one the API accepts.
+
+    """
+    params = {}
+    if start is not None:
+        params['start'] = start
+    if end is not None:
+        params['end'] = end
+    if granularity is not None:
+        if granularity not in _ACCEPTED_GRANS:
+            raise ValueError('Specified granularity is {}, must be in '
+                             'approved values: {}'.format(
+                                 granularity, sorted(_ACCEPTED_GRANS)))
+        params['granularity'] = granularity
+    return params
+
+
+def _raise_for_api_error(r):
+    """Raise `requests.HTTPError` carrying the API's message if `r` is an
+    error response."""
+    if r.ok:
+        return
+    try:
+        message = _loads(r.content).get('message')
+    except (ValueError, AttributeError):
+        message = None
+    raise requests.HTTPError('{} Error: {} for url: {}'.format(
+        r.status_code, message or r.reason, r.url), response=r)
+
+
+def _candles_to_numpy(candles):
+    """Convert a candles response to a (N, 6) float64 array.
+
+    Error responses (anything other than a list) are returned unchanged.
+
+    """
+    if not isinstance(candles, list):
+        return candles
+    import numpy as np
+    return np.asarray(candles, dtype=np.float64).reshape(-1, 6)
+
+
+def _convert_numbers(result, convert):
+    """Convert the numeric string fields of a decoded response in place.
+
+    Known numeric fields of each object are passed through `convert`, as
+    are the price and size of each `bids`/`asks` level of an order book.
+
+    Args:
+        result (dict/list): Decoded JSON response
+        convert (callable): `float` or `Decimal`
+
+    Returns:
+        dict/list: `result`
+
+    """
+    rows = result if isinstance(result, list) else (result,)
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        for key in _NUMERIC_FIELDS.intersection(row):
+            value = row[key]
+            if isinstance(value, str):
+                row[key] = convert(value)
+        for key in ('bids', 'asks'):
+            for level in row.get(key, ()):
+                level[0] = convert(level[0])
+                level[1] = convert(level[1])
+    return result
+
+
+class PaginationCursor(object):
+    """Tracks the `after` cursor of a paginated request.
+
+    Paginated API messages support `before`, `after`, and `limit`
+    parameters; see `PublicClient._send_paginated_message`. The cursor
+    reads them once up front and updates `params['after']` in place as
+    pages are consumed.
+
+    Attributes:
+        params (dict): HTTP request parameters, updated in place.
+        limit (int): Requested page size, or None for the API default.
+        single_page (bool): True if only one page will be fetched.
+
+    """
+    __slots__ = ('params', 'limit', 'single_page')
+
+    def __init__(self, params):
+        self.params = params
+        limit = params.get('limit')
+        self.limit = int(limit) if limit is not None else None
+        # If this request included `before` don't get any more pages - the
+        # cbpro API doesn't support multiple pages in that case.
+        self.single_page = params.get('before') is not None
+
+    def advance(self, next_after):
+        """Move the cursor past the page that reported `next_after`.
+
+        Args:
+            next_after (str): `cb-after` header of the last response,
+                or None if there was none.
+
+        Returns:
+            bool: True if there is another page to fetch.
+
+        """
+        if not next_after or self.single_page:
+            return False
+        if self.params.get('after') != next_after:
+            self.params['after'] = next_after
+        return True
 
 
 class PublicClient(object):
@@ -15,23 +174,73 @@ class PublicClient(object):
 
     Attributes:
         url (Optional[str]): API URL. Defaults to cbpro API.
+        timeout (float or tuple): Request timeout in seconds, or a
+            (connect, read) tuple.
+        bucket (TokenBucket): Rate limiter shared by every request made
+            through this client.
+        breaker (CircuitBreaker): Stops sending requests for a while
+            after repeated failures.
 
     """
 
-    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30):
+    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30,
+                 rate=3, burst=6, max_retries=5, cache_ttl=None,
+                 numeric='str'):
         """Create cbpro API public client.
 
         Args:
             api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float or tuple]): Request timeout in
+                seconds, or a (connect, read) tuple. Default is 30.
+            rate (Optional[float]): Requests per second allowed by the
+                client-side rate limiter. Default is 3.
+            burst (Optional[int]): Requests that may be sent at once
+                before `rate` applies. Default is 6.
+            max_retries (Optional[int]): Times a rate limited or failed
+                request is retried before its response is returned.
+                Default is 5.
+            cache_ttl (Optional[float]): Seconds for which responses of
+                slowly changing endpoints (`get_products`,
+                `get_currencies`) are served from memory. Default is
+                None, which uses a per-endpoint TTL; 0 disables caching.
+            numeric (Optional[str]): How numeric fields such as prices
+                and sizes are returned: 'str' (as sent by the API, the
+                default), 'float' or 'decimal'.
 
         """
+        if numeric not in _NUMERIC_CONVERTERS:
+            raise ValueError('numeric must be one of {}'.format(
+                sorted(_NUMERIC_CONVERTERS)))
         self.url = api_url.rstrip('/')
-        self.auth = None
+        self.timeout = timeout
         self.session = requests.Session()
+        # A single large pool lets threads sharing this client reuse
+        # keep-alive connections instead of re-handshaking TLS.
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                              max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Order books and trade pages compress well. Advertise every
+        # encoding urllib3 can decode here (br needs `brotli` installed).
+        self.session.headers.update({
+            'Accept-Encoding': ACCEPT_ENCODING,
+            'User-Agent': 'cbpro-python',
+            'Connection': 'keep-alive',
+        })
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        self.max_retries = max_retries
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._convert = _NUMERIC_CONVERTERS[numeric]
 
     def get_products(self):
         """Get a list of available currency pairs for trading.
 
+        Responses are cached for 5 minutes (see `cache_ttl`). Each call
+        returns a new list, but the product dicts in it are shared with
+        other callers and should not be modified.
+
         Returns:
             list: Info about all currency pairs. Example::
                 [
@@ -47,7 +256,7 @@ class PublicClient(object):
                 ]
 
         """
-        return self._send_message('get', '/products')
+        return self._cached_get('/products', ttl=300)
 
     def get_product_order_book(self, product_id, level=1):
         """Get a list of open orders for a product.
@@ -86,7 +295,7 @@ class PublicClient(object):
         """
         params = {'level': level}
         return self._send_message('get',
-                                  '/products/{}/book'.format(product_id),
+                                  _product_endpoint(product_id, '/book'),
                                   params=params)
 
     def get_product_ticker(self, product_id):
@@ -112,7 +321,7 @@ class PublicClient(object):
 
         """
         return self._send_message('get',
-                                  '/products/{}/ticker'.format(product_id))
+                                  _product_endpoint(product_id, '/ticker'))
 
     def get_product_trades(self, product_id, before='', after='', limit=None, result=None):
         """List the latest trades for a product.
@@ -143,11 +352,75 @@ class PublicClient(object):
                      "side": "sell"
          }]
         """
-        return self._send_paginated_message('/products/{}/trades'
-                                            .format(product_id))
+        return self._send_paginated_message(
+            _product_endpoint(product_id, '/trades'))
+
+    def fetch_product_trades(self, product_id, limit, as_numpy=False):
+        """Fetch the latest `limit` trades for a product at once.
+
+        Unlike `get_product_trades`, this pages through the trades eagerly
+        and returns them in a container sized up front for `limit`
+        trades.
+
+        Args:
+            product_id (str): Product
+            limit (int): Maximum number of trades to fetch. Must be at
+                least 1.
+            as_numpy (Optional[bool]): Return a NumPy structured array
+                with fields `trade_id` (int64), `price` (float64), `size`
+                (float64), `side` (uint8, 1 for buy and 0 for sell) and
+                `time` (str). Requires numpy.
+
+        Returns:
+            list: Latest trades, newest first, in the format of
+                `get_product_trades`.
+            numpy.ndarray: With `as_numpy`, a structured array holding
+                the same trades.
+
+        Raises:
+            requests.HTTPError: If the API answers with an error, e.g.
+                for an unknown product.
+            ValueError: If the API returns something other than trades.
+
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1, got {}'.format(limit))
+        params = {'limit': min(limit, 100)}
+        trades = self._send_paginated_message(
+            _product_endpoint(product_id, '/trades'), params=params,
+            raise_errors=True)
+        if as_numpy:
+            import numpy as np
+            out = np.empty(limit, dtype=[('trade_id', 'i8'), ('price', 'f8'),
+                                         ('size', 'f8'), ('side', 'u1'),
+                                         ('time', 'U27')])
+        else:
+            out = [None] * limit
+        n = 0
+        try:
+            for trade in trades:
+                if not isinstance(trade, dict):
+                    raise ValueError('Expected a trade, got {!r}'.format(
+                        trade))
+                if as_numpy:
+                    out[n] = (trade['trade_id'], float(trade['price']),
+                              float(trade['size']), trade['side'] == 'buy',
+                              trade['time'])
+                else:
+                    out[n] = trade
+                n += 1
+                # Stop before the generator requests another page.
+                if n == limit:
+                    break
+        finally:
+            # Stop any page still being streamed.
+            trades.close()
+        if n < limit:
+            out = out[:n]
+        return out
 
     def get_product_historic_rates(self, product_id, start=None, end=None,
-                                   granularity=None):
+                                   granularity=None, as_numpy=False):
         """Historic rates for a product.
 
         Rates are returned in grouped buckets based on requested
@@ -173,6 +446,8 @@ class PublicClient(object):
             start (Optional[str]): Start time in ISO 8601
             end (Optional[str]): End time in ISO 8601
             granularity (Optional[int]): Desired time slice in seconds
+            as_numpy (Optional[bool]): Return the candles as a NumPy
+                array instead of nested lists. Requires numpy.
 
         Returns:
             list: Historic candle data. Example:
@@ -181,23 +456,17 @@ class PublicClient(object):
                     [ 1415398768, 0.32, 4.2, 0.35, 4.2, 12.3 ],
                     ...
                 ]
+            numpy.ndarray: With `as_numpy`, a float64 array of shape
+                (N, 6) with the same column order.
 
         """
-        params = {}
-        if start is not None:
-            params['start'] = start
-        if end is not None:
-            params['end'] = end
-        if granularity is not None:
-            acceptedGrans = [60, 300, 900, 3600, 21600, 86400]
-            if granularity not in acceptedGrans:
-                raise ValueError( 'Specified granularity is {}, must be in approved values: {}'.format(
-                        granularity, acceptedGrans) )
-
-            params['granularity'] = granularity
-        return self._send_message('get',
-                                  '/products/{}/candles'.format(product_id),
-                                  params=params)
+        params = _historic_rates_params(start, end, granularity)
+        candles = self._send_message('get',
+                                     _product_endpoint(product_id, '/candles'),
+                                     params=params)
+        if as_numpy:
+            return _candles_to_numpy(candles)
+        return candles
 
     def get_product_24hr_stats(self, product_id):
         """Get 24 hr stats for the product.
@@ -217,11 +486,15 @@ class PublicClient(object):
 
         """
         return self._send_message('get',
-                                  '/products/{}/stats'.format(product_id))
+                                  _product_endpoint(product_id, '/stats'))
 
     def get_currencies(self):
         """List known currencies.
 
+        Responses are cached for an hour (see `cache_ttl`). Each call
+        returns a new list, but the currency dicts in it are shared with
+        other callers and should not be modified.
+
         Returns:
             list: List of currencies. Example::
                 [{
@@ -235,7 +508,7 @@ class PublicClient(object):
                 }]
 
         """
-        return self._send_message('get', '/currencies')
+        return self._cached_get('/currencies', ttl=3600)
 
     def get_time(self):
         """Get the API server time.
@@ -251,6 +524,40 @@ class PublicClient(object):
         """
         return self._send_message('get', '/time')
 
+    def clear_cache(self):
+        """Drop all cached responses so the next call hits the API."""
+        self._cache.clear()
+
+    def _cached_get(self, endpoint, ttl):
+        """Send a GET request, reusing a recent response if available.
+
+        A cached list is returned as a shallow copy, so callers may sort
+        or filter it; the objects in it are shared between callers.
+
+        Args:
+            endpoint (str): Endpoint (to be added to base URL)
+            ttl (float): Seconds a response stays fresh, unless
+                overridden by `cache_ttl`.
+
+        Returns:
+            dict/list: JSON response
+
+        """
+        if self.cache_ttl is not None:
+            ttl = self.cache_ttl
+        if ttl <= 0:
+            return self._send_message('get', endpoint)
+        now = time.monotonic()
+        cached = self._cache.get(endpoint)
+        if cached is not None and now - cached[0] < ttl:
+            return copy.copy(cached[1])
+        result = self._send_message('get', endpoint)
+        # Don't cache error responses such as {"message": "..."}.
+        if not isinstance(result, dict) or 'message' not in result:
+            self._cache[endpoint] = (now, result)
+            return copy.copy(result)
+        return result
+
     def _send_message(self, method, endpoint, params=None, data=None):
         """Send API request.
 
@@ -265,11 +572,59 @@ class PublicClient(object):
 
         """
         url = self.url + endpoint
-        r = self.session.request(method, url, params=params, data=data,
-                                 auth=self.auth, timeout=30)
-        return r.json()
+        r = self._request_with_retry(method, url, params=params, data=data,
+                                     timeout=self.timeout)
+        result = _loads(r.content)
+        if self._convert is not None:
+            result = _convert_numbers(result, self._convert)
+        return result
+
+    def _request_with_retry(self, method, url, **kwargs):
+        """Send a rate limited HTTP request, retrying transient failures.
+
+        429 responses are always retried, as the exchange rejected the
+        request without acting on it. 5xx responses are only retried for
+        GET requests, since e.g. a failed order placement may still have
+        been executed. The delay honours `Retry-After` when present and
+        otherwise backs off exponentially with jitter.
+
+        Args:
+            method (str): HTTP method (get, post, delete, etc.)
+            url (str): Full request URL
+            **kwargs: Passed through to `requests.Session.request`
+
+        Returns:
+            requests.Response: The first non-retriable response, or the
+                last response once `max_retries` is exhausted.
 
-    def _send_paginated_message(self, endpoint, params=None):
+        Raises:
+            CircuitOpen: If too many recent calls have failed. The
+                breaker is checked once per call and is told the outcome
+                of the call as a whole, so retries within one call never
+                trip it.
+
+        """
+        self.breaker.before_request()
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.bucket.acquire()
+                r = self.session.request(method, url, **kwargs)
+                if (attempt == self.max_retries or
+                        r.status_code not in RETRY_STATUSES or
+                        (r.status_code != 429 and method.lower() != 'get')):
+                    self.breaker.record(r.status_code not in RETRY_STATUSES)
+                    return r
+                delay = parse_retry_after(r.headers)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                r.close()
+                time.sleep(delay)
+        except requests.RequestException:
+            self.breaker.record(False)
+            raise
+
+    def _send_paginated_message(self, endpoint, params=None,
+                                raise_errors=False):
         """ Send API message that results in a paginated response.
 
         The paginated responses are abstracted away by making API requests on
@@ -287,25 +642,59 @@ class PublicClient(object):
         Args:
             endpoint (str): Endpoint (to be added to base URL)
             params (Optional[dict]): HTTP request parameters
+            raise_errors (Optional[bool]): Raise on an error response
+                instead of yielding the keys of the error object.
 
         Yields:
             dict: API response objects
 
+        Raises:
+            requests.HTTPError: With `raise_errors`, if a page is an
+                error response.
+
         """
         if params is None:
             params = dict()
         url = self.url + endpoint
+        cursor = PaginationCursor(params)
         while True:
-            r = self.session.get(url, params=params, auth=self.auth, timeout=30)
-            results = r.json()
-            for result in results:
-                yield result
-            # If there are no more pages, we're done. Otherwise update `after`
-            # param to get next page.
-            # If this request included `before` don't get any more pages - the
-            # cbpro API doesn't support multiple pages in that case.
-            if not r.headers.get('cb-after') or \
-                    params.get('before') is not None:
+            r = self._request_with_retry('get', url, params=params,
+                                         timeout=self.timeout,
+                                         stream=ijson is not None)
+            try:
+                if raise_errors:
+                    _raise_for_api_error(r)
+                yield from self._iter_results(r)
+            finally:
+                r.close()
+            # If there are no more pages, we're done. Otherwise the cursor
+            # updates the `after` param to get the next page.
+            if not cursor.advance(r.headers.get('cb-after')):
                 break
-            else:
-                params['after'] = r.headers['cb-after']
+
+    def _iter_results(self, r):
+        """Iterate over the items of a JSON array response.
+
+        When ijson is installed the response must have been requested with
+        `stream=True`; items are then parsed incrementally from the socket
+        so a page never has to be fully materialized, and abandoning the
+        iteration leaves the rest of the page unparsed. Error responses
+        are always decoded in full, exactly as without ijson, since their
+        body is an object rather than an array.
+
+        Args:
+            r (requests.Response): Response to a paginated request
+
+        Returns:
+            iterable: API response objects
+
+        """
+        if ijson is None or not r.ok:
+            results = _loads(r.content)
+        else:
+            r.raw.decode_content = True
+            results = ijson.items(r.raw, 'item', use_float=True)
+        if self._convert is not None:
+            convert = self._convert
+            results = (_convert_numbers(x, convert) for x in results)
+        return results
@@ -0,0 +1,201 @@
+#
+# cbpro/RateLimiter.py
+#
+# Client-side request pacing, retry backoff and circuit breaking for the
+# Coinbase exchange
+
+import email.utils
+import random
+import threading
+import time
+
+# Responses worth retrying: rate limited or a transient server error.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class TokenBucket(object):
+    """Token bucket used to pace requests to the cbpro API.
+
+    Tokens refill continuously at `rate` per second up to `capacity`;
+    each request consumes one. Callers reserve a token first and are
+    told how long to wait for it, so the same bucket can be shared by
+    threads (`acquire`) and by coroutines (`await asyncio.sleep(...)`
+    on the value returned from `reserve`).
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens (burst size).
+
+    """
+
+    def __init__(self, rate=3, capacity=6):
+        """Create a token bucket that starts full.
+
+        Args:
+            rate (Optional[float]): Sustained requests per second.
+                Default is 3, the cbpro public endpoint limit.
+            capacity (Optional[float]): Burst size. Default is 6.
+
+        """
+        if rate <= 0 or capacity < 1:
+            raise ValueError('rate must be positive and capacity at least 1')
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self):
+        """Take a token, possibly one that has not been refilled yet.
+
+        Returns:
+            float: Seconds the caller must wait before sending.
+
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self):
+        """Take a token only if one is available right now.
+
+        Returns:
+            bool: True if a token was taken.
+
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def refund(self):
+        """Return a token taken for a request that was never sent."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def acquire(self):
+        """Block the calling thread until a token is available."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending a request while the circuit is open."""
+    pass
+
+
+class CircuitBreaker(object):
+    """Fails requests fast while the API is persistently failing.
+
+    The clients consult the breaker once per API call, after its
+    retries: a call fails if it still ends in a 429 or 5xx response, or
+    raises a network error. After `failure_threshold` consecutive failed
+    calls the circuit opens and `before_request` raises `CircuitOpen`
+    for `recovery_seconds`. After that one trial call is let through
+    (half-open): success closes the circuit, failure opens it for
+    another period.
+
+    Attributes:
+        failure_threshold (int): Consecutive failed calls that open the
+            circuit.
+        recovery_seconds (float): How long the circuit stays open.
+
+    """
+
+    def __init__(self, failure_threshold=5, recovery_seconds=10):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Check that a call may be made.
+
+        Raises:
+            CircuitOpen: If the circuit is open.
+
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + self.recovery_seconds - now
+            if remaining > 0:
+                raise CircuitOpen('Too many failed requests, not sending '
+                                  'requests for {:.1f}s'.format(remaining))
+            # Let this request through as the trial and keep failing the
+            # others fast until it reports back (or another period ends).
+            self._opened_at = now
+
+    def record(self, success):
+        """Report the outcome of a call.
+
+        Args:
+            success (bool): False if the call ended in a 429 or 5xx
+                response or a network error.
+
+        """
+        with self._lock:
+            if success:
+                self._failures = 0
+                self._opened_at = None
+            else:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._opened_at = time.monotonic()
+
+
+def parse_retry_after(headers):
+    """Read the delay requested by a `Retry-After` response header.
+
+    Args:
+        headers (Mapping): Response headers.
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or
+            malformed. Both the delta-seconds and HTTP-date forms are
+            understood.
+
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=0.1):
+    """Exponential backoff with jitter for the given retry attempt.
+
+    Args:
+        attempt (int): Zero-based retry attempt.
+        base (Optional[float]): Delay of the first retry in seconds.
+
+    Returns:
+        float: base * 2**attempt, scaled by a random factor in
+            [0.75, 1.25].
+
+    """
+    return base * 2 ** attempt * random.uniform(0.75, 1.25)
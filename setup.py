@@ -26,10 +26,15 @@ setup(
     license='MIT',
     url='https://github.com/danpaquin/coinbasepro-python',
     packages=find_packages(),
+    python_requires='>=3.7',
     install_requires=install_requires,
     tests_require=tests_require,
     extras_require={
         'test': tests_require,
+        'async': ['aiohttp>=3.0', 'uvloop; sys_platform != "win32"'],
+        'http2': ['httpx[http2]'],
+        'speedups': ['orjson', 'brotli', 'ijson>=3.1'],
+        'numpy': ['numpy'],
     },
     description='The unofficial Python client for the Coinbase Pro API',
     long_description=long_description,
@@ -44,12 +49,12 @@ setup(
         'Intended Audience :: Information Technology',
         'Topic :: Software Development :: Libraries :: Python Modules',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )
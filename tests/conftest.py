@@ -0,0 +1,151 @@
+import asyncio
+import io
+import json
+
+import pytest
+import requests
+import urllib3
+
+from cbpro.public_client import PublicClient
+
+
+class ScriptedSession(object):
+    """Stands in for requests.Session, answering with scripted
+    (status, body, headers) tuples and repeating the last one."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        status, body, headers = self.responses[
+            min(len(self.calls), len(self.responses)) - 1]
+        r = requests.Response()
+        r.status_code = status
+        r.headers.update(headers)
+        r.raw = urllib3.HTTPResponse(body=io.BytesIO(body), status=status,
+                                     headers=headers, preload_content=False)
+        return r
+
+
+class PagingSession(ScriptedSession):
+    """Serves `top` trades newest first, honouring `after` and `limit`."""
+
+    def __init__(self, top):
+        super(PagingSession, self).__init__()
+        self.top = top
+
+    def request(self, method, url, **kwargs):
+        params = kwargs.get('params') or {}
+        after = int(params.get('after', self.top + 1))
+        limit = int(params.get('limit', 100))
+        ids = list(range(after - 1, max(after - 1 - limit, 0), -1))
+        body = json.dumps([{'trade_id': i, 'price': '1.0', 'size': '0.5',
+                            'side': 'buy', 'time': '2014-11-07T22:19:28Z'}
+                           for i in ids]).encode()
+        headers = {'cb-after': str(ids[-1])} if ids else {}
+        self.responses = [(200, body, headers)]
+        return super(PagingSession, self).request(method, url, **kwargs)
+
+
+class ScriptedFetch(object):
+    """Stands in for `AsyncPublicClient._fetch`, answering with scripted
+    (status, body, headers) tuples and repeating the last one."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def __call__(self, method, url, params=None, data=None):
+        self.calls.append((method, url))
+        status, body, headers = self.responses[
+            min(len(self.calls), len(self.responses)) - 1]
+        return status, headers, body
+
+
+class FakeTradesAPI(object):
+    """Stands in for `AsyncPublicClient._fetch`, serving `top` trades newest
+    first in pages of `limit`, where trade ids step by `gap` (gap > 1 makes
+    predicted cursors wrong). The `after` of each request is recorded."""
+
+    def __init__(self, top, limit=100, gap=1):
+        self.ids = list(range(top, 0, -gap))
+        self.limit = limit
+        self.calls = []
+
+    async def __call__(self, method, url, params=None, data=None):
+        after = int((params or {}).get('after', self.ids[0] + 1))
+        self.calls.append(after)
+        await asyncio.sleep(0)
+        page = [i for i in self.ids if i < after][:self.limit]
+        headers = {'cb-after': str(page[-1])} if page else {}
+        body = json.dumps([{'trade_id': i} for i in page]).encode()
+        return 200, headers, body
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the delays of `time.sleep` and `asyncio.sleep` calls
+    instead of sleeping."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+    monkeypatch.setattr('time.sleep', delays.append)
+    monkeypatch.setattr('asyncio.sleep', fake_sleep)
+    return delays
+
+
+@pytest.fixture
+def scripted_session():
+    """Factory for `ScriptedSession`s."""
+    return ScriptedSession
+
+
+@pytest.fixture
+def scripted_client():
+    """Factory for unthrottled `PublicClient`s answered by a
+    `ScriptedSession`."""
+    def make(*responses, **kwargs):
+        c = PublicClient(rate=1000, burst=1000, **kwargs)
+        c.session = ScriptedSession(*responses)
+        return c
+    return make
+
+
+@pytest.fixture
+def paging_client():
+    """Factory for unthrottled `PublicClient`s answered by a
+    `PagingSession`."""
+    def make(top=1000, **kwargs):
+        c = PublicClient(rate=1000, burst=1000, **kwargs)
+        c.session = PagingSession(top)
+        return c
+    return make
+
+
+@pytest.fixture
+def async_scripted_client():
+    """Factory for unthrottled `AsyncPublicClient`s answered by a
+    `ScriptedFetch`, or by the given `fetch` coroutine function."""
+    from cbpro.async_public_client import AsyncPublicClient
+
+    def make(*responses, fetch=None, **kwargs):
+        c = AsyncPublicClient(rate=1000, burst=1000, **kwargs)
+        c._fetch = fetch or ScriptedFetch(*responses)
+        return c
+    return make
+
+
+@pytest.fixture
+def async_paging_client():
+    """Factory for `AsyncPublicClient`s answered by a `FakeTradesAPI`.
+    The burst is kept small so prefetching is limited by the bucket."""
+    from cbpro.async_public_client import AsyncPublicClient
+
+    def make(top, gap=1, rate=1000, burst=6, **kwargs):
+        c = AsyncPublicClient(rate=rate, burst=burst, **kwargs)
+        c._fetch = FakeTradesAPI(top, gap=gap)
+        return c
+    return make
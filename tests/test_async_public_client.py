@@ -0,0 +1,326 @@
+import pytest
+import asyncio
+import json
+import sys
+import types
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from cbpro.async_public_client import AsyncPublicClient, uvloop_factory
+from cbpro.rate_limiter import CircuitOpen
+
+
+def run(coro_fn):
+    async def wrapper():
+        async with AsyncPublicClient() as client:
+            return await coro_fn(client)
+    return asyncio.run(wrapper())
+
+
+class TestAsyncPublicClient(object):
+
+    def test_get_products(self):
+        r = run(lambda c: c.get_products())
+        assert type(r) is list
+
+    def test_get_product_ticker(self):
+        r = run(lambda c: c.get_product_ticker('BTC-USD'))
+        assert type(r) is dict
+        assert 'ask' in r
+        assert 'trade_id' in r
+
+    def test_gather_tickers(self):
+        r = run(lambda c: c.gather_tickers(['BTC-USD', 'ETH-USD']))
+        assert type(r) is list
+        assert len(r) == 2
+        assert all('trade_id' in t for t in r)
+
+    def test_get_product_trades(self):
+        async def take(client):
+            trades = []
+            async for trade in client.get_product_trades('BTC-USD'):
+                trades.append(trade)
+                if len(trades) == 200:
+                    break
+            return trades
+        r = run(take)
+        assert 'trade_id' in r[0]
+
+    def test_get_historic_rates_granularity(self):
+        with pytest.raises(ValueError):
+            run(lambda c: c.get_product_historic_rates('BTC-USD',
+                                                       granularity=42))
+
+
+def collect(client, limit=None):
+    async def take():
+        trades = []
+        gen = client.get_product_trades('BTC-USD')
+        async for trade in gen:
+            trades.append(trade['trade_id'])
+            if len(trades) == limit:
+                break
+        await gen.aclose()
+        # Let cancelled page tasks finish.
+        await asyncio.sleep(0.01)
+        return trades
+    return asyncio.run(take())
+
+
+class TestAsyncPagination(object):
+
+    def test_pages_in_order(self, async_paging_client):
+        assert collect(async_paging_client(1050)) == list(range(1050, 0, -1))
+
+    def test_wrong_prediction_falls_back_to_real_cursor(
+            self, async_paging_client):
+        c = async_paging_client(2000, gap=3)
+        assert collect(c) == list(range(2000, 0, -3))
+
+    def test_short_last_page_stops(self, async_paging_client):
+        c = async_paging_client(250)
+        assert collect(c) == list(range(250, 0, -1))
+        # Three pages; the third is short so nothing past it is requested.
+        assert sorted(c._fetch.calls, reverse=True) == [251, 151, 51]
+
+    def test_next_page_is_not_delayed_by_prefetching(
+            self, async_paging_client):
+        c = async_paging_client(1000, rate=2, burst=3)
+        api, sent = c._fetch, []
+
+        async def fetch(method, url, params=None, data=None):
+            sent.append((int(params.get('after', 1001)),
+                         asyncio.get_running_loop().time()))
+            return await api(method, url, params=params, data=data)
+        c._fetch = fetch
+        assert len(collect(c, limit=200)) == 200
+        # The first page leaves two tokens: one goes to the page needed
+        # next, only the other to a speculative page.
+        start = sent[0][1]
+        assert [(after, t - start < 0.1) for after, t in sent[:3]] == [
+            (1001, True), (901, True), (801, True)]
+        assert all(t - start >= 0.4 for _, t in sent[3:])
+
+    def test_early_close_returns_unsent_tokens(self, async_paging_client):
+        c = async_paging_client(5000, rate=1)
+        assert len(collect(c, limit=101)) == 101
+        # Speculative pages never put the bucket into debt, so the next
+        # request waits at most for one token to refill.
+        assert c.bucket.reserve() <= 1.01
+
+
+class TestAsyncRequestWithRetry(object):
+
+    def test_429_is_retried_for_post(self, async_scripted_client, sleeps):
+        c = async_scripted_client((429, b'{}', {}), (200, b'{"id": 1}', {}))
+        r = asyncio.run(c._send_message('post', '/orders', data='{}'))
+        assert r == {'id': 1}
+        assert len(c._fetch.calls) == 2
+
+    def test_5xx_is_not_retried_for_post(self, async_scripted_client, sleeps):
+        c = async_scripted_client((500, b'{"message": "oops"}', {}),
+                                  (200, b'{"id": 1}', {}))
+        r = asyncio.run(c._send_message('post', '/orders', data='{}'))
+        assert r == {'message': 'oops'}
+        assert len(c._fetch.calls) == 1
+
+    def test_last_response_returned_when_retries_exhausted(
+            self, async_scripted_client, sleeps):
+        c = async_scripted_client((503, b'{"message": "first"}', {}),
+                                  (503, b'{"message": "last"}', {}),
+                                  max_retries=1)
+        assert asyncio.run(c.get_time()) == {'message': 'last'}
+        assert len(c._fetch.calls) == 2
+
+    def test_retry_after_is_honoured(self, async_scripted_client, sleeps):
+        c = async_scripted_client((429, b'{}', {'Retry-After': '3'}),
+                                  (200, b'{"iso": "x"}', {}))
+        assert asyncio.run(c.get_time()) == {'iso': 'x'}
+        assert 3.0 in sleeps
+
+
+class TestHttp2Transport(object):
+
+    @pytest.fixture
+    def requests_seen(self, monkeypatch):
+        httpx = pytest.importorskip('httpx')
+        pytest.importorskip('h2')
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, json={'trade_id': 1, 'price': '2.5'})
+        real_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            httpx, 'AsyncClient',
+            lambda **kwargs: real_client(
+                transport=httpx.MockTransport(handler), **kwargs))
+        return seen
+
+    def test_requests_go_through_httpx(self, requests_seen):
+        async def go():
+            async with AsyncPublicClient(http2=True, numeric='float',
+                                         ticker_batch_ms=0) as c:
+                book = await c.get_product_order_book('BTC-USD', level=2)
+                ticker = await c.get_product_ticker('BTC-USD')
+                return book, ticker
+        book, ticker = asyncio.run(go())
+        assert ticker == {'trade_id': 1, 'price': 2.5}
+        request = requests_seen[0]
+        assert request.method == 'GET'
+        assert request.url.path == '/products/BTC-USD/book'
+        assert request.url.params['level'] == '2'
+
+    @pytest.mark.parametrize('timeout,expected', [
+        (30, dict(connect=30, read=30, write=30, pool=30)),
+        ((3, 10), dict(connect=3, read=10, write=None, pool=None)),
+    ])
+    def test_timeout_mapping(self, requests_seen, timeout, expected):
+        async def go():
+            async with AsyncPublicClient(http2=True, timeout=timeout) as c:
+                return c.session.timeout.as_dict()
+        assert asyncio.run(go()) == expected
+
+
+class TestTickerBatching(object):
+
+    def test_concurrent_calls_are_coalesced_and_deduplicated(
+            self, async_scripted_client):
+        calls = []
+
+        async def fetch(method, url, params=None, data=None):
+            calls.append(url)
+            product_id = url.split('/')[-2]
+            return 200, {}, json.dumps({'product': product_id}).encode()
+
+        async def go():
+            c = async_scripted_client(fetch=fetch, max_retries=0)
+            first = await asyncio.gather(c.get_product_ticker('BTC-USD'),
+                                         c.get_product_ticker('ETH-USD'),
+                                         c.get_product_ticker('BTC-USD'))
+            second = await c.get_product_ticker('BTC-USD')
+            return first, second
+        first, second = asyncio.run(go())
+        assert [t['product'] for t in first] == ['BTC-USD', 'ETH-USD',
+                                                 'BTC-USD']
+        assert second == {'product': 'BTC-USD'}
+        assert sorted(calls[:2]) == [
+            'https://api.pro.coinbase.com/products/BTC-USD/ticker',
+            'https://api.pro.coinbase.com/products/ETH-USD/ticker']
+        assert len(calls) == 3
+
+    def test_exceptions_reach_only_their_callers(self, async_scripted_client):
+        async def fetch(method, url, params=None, data=None):
+            if 'BAD' in url:
+                raise aiohttp.ClientConnectionError('boom')
+            return 200, {}, b'{"price": "1"}'
+
+        async def go():
+            c = async_scripted_client(fetch=fetch, max_retries=0)
+            return await asyncio.gather(c.get_product_ticker('BAD'),
+                                        c.get_product_ticker('BAD'),
+                                        c.get_product_ticker('BTC-USD'),
+                                        return_exceptions=True)
+        bad1, bad2, good = asyncio.run(go())
+        assert isinstance(bad1, aiohttp.ClientConnectionError)
+        assert bad2 is bad1
+        assert good == {'price': '1'}
+
+    def test_cancelled_fetch_cancels_its_callers(self, async_scripted_client):
+        async def fetch(method, url, params=None, data=None):
+            raise asyncio.CancelledError()
+
+        async def go():
+            c = async_scripted_client(fetch=fetch, max_retries=0)
+            try:
+                await c.get_product_ticker('BTC-USD')
+            except asyncio.CancelledError:
+                return 'cancelled'
+            return 'returned'
+        assert asyncio.run(go()) == 'cancelled'
+
+    def test_cancelled_batch_cancels_waiters(self, async_scripted_client):
+        async def fetch(method, url, params=None, data=None):
+            await asyncio.Event().wait()
+
+        async def go():
+            c = async_scripted_client(fetch=fetch, max_retries=0)
+            waiter = asyncio.ensure_future(c.get_product_ticker('BTC-USD'))
+            await asyncio.sleep(0.05)
+            for task in list(c._ticker_batcher._tasks):
+                task.cancel()
+            return await asyncio.wait_for(
+                asyncio.gather(waiter, return_exceptions=True), 1)
+        r, = asyncio.run(go())
+        assert isinstance(r, asyncio.CancelledError)
+
+    def test_batcher_survives_its_event_loop(self, async_scripted_client):
+        c = async_scripted_client((200, b'{"price": "1"}', {}))
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(c.get_product_ticker('BTC-USD'),
+                                         0.001))
+        # The first loop ended before its batch was sent.
+        r = asyncio.run(asyncio.wait_for(c.get_product_ticker('BTC-USD'), 1))
+        assert r == {'price': '1'}
+
+
+class TestUvloopFactory(object):
+
+    def test_uvloop_available(self, monkeypatch):
+        fake_uvloop = types.ModuleType('uvloop')
+        fake_uvloop.new_event_loop = asyncio.new_event_loop
+        monkeypatch.setitem(sys.modules, 'uvloop', fake_uvloop)
+        monkeypatch.setattr(sys, 'platform', 'linux')
+        assert uvloop_factory() is asyncio.new_event_loop
+
+    def test_uvloop_missing(self, monkeypatch):
+        monkeypatch.setitem(sys.modules, 'uvloop', None)
+        monkeypatch.setattr(sys, 'platform', 'linux')
+        assert uvloop_factory() is None
+
+    def test_windows(self, monkeypatch):
+        fake_uvloop = types.ModuleType('uvloop')
+        fake_uvloop.new_event_loop = asyncio.new_event_loop
+        monkeypatch.setitem(sys.modules, 'uvloop', fake_uvloop)
+        monkeypatch.setattr(sys, 'platform', 'win32')
+        assert uvloop_factory() is None
+
+
+class TestAsyncRetryAndCircuitBreaker(object):
+
+    def test_retries_complete_before_breaker_trips(self, async_scripted_client,
+                                                   sleeps):
+        c = async_scripted_client((503, b'{"message": "down"}', {}))
+
+        async def go():
+            for call in range(5):
+                assert await c.get_time() == {'message': 'down'}
+                assert len(c._fetch.calls) == 6 * (call + 1)
+            with pytest.raises(CircuitOpen):
+                await c.get_time()
+        asyncio.run(go())
+        assert len(c._fetch.calls) == 30
+
+    def test_transport_errors_count_as_failures(self, async_scripted_client,
+                                                sleeps):
+        async def fetch(method, url, params=None, data=None):
+            raise aiohttp.ClientConnectionError('unreachable')
+        c = async_scripted_client(fetch=fetch)
+
+        async def go():
+            for _ in range(5):
+                with pytest.raises(aiohttp.ClientConnectionError):
+                    await c.get_time()
+            with pytest.raises(CircuitOpen):
+                await c.get_time()
+        asyncio.run(go())
+
+    def test_programming_errors_do_not_trip_breaker(self):
+        # Used outside `async with`, so there is no session.
+        c = AsyncPublicClient(rate=1000, burst=1000)
+
+        async def go():
+            for _ in range(10):
+                with pytest.raises(AttributeError):
+                    await c.get_time()
+        asyncio.run(go())
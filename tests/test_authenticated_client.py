@@ -206,3 +206,12 @@ class TestAuthenticatedClient(object):
     def test_get_fees(self, client):
         r = client.get_fees()
         assert type(r) is dict
+
+
+def test_replaced_session_is_used_and_signed(scripted_session):
+    client = AuthenticatedClient('test', 'dGVzdA==', 'test')
+    client.session = scripted_session((200, b'{}', {}))
+    assert client.get_account('abc') == {}
+    method, url, kwargs = client.session.calls[0]
+    assert url.endswith('/accounts/abc')
+    assert kwargs['auth'] is client.auth
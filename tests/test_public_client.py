@@ -1,9 +1,13 @@
 import pytest
 import time
+import requests
 from itertools import islice
 import datetime
+from decimal import Decimal
 from dateutil.relativedelta import relativedelta
-from cbpro.public_client import PublicClient
+from cbpro.rate_limiter import CircuitOpen
+from cbpro.public_client import (PaginationCursor, PublicClient,
+                                 _candles_to_numpy, _convert_numbers)
 
 
 @pytest.fixture(scope='module')
@@ -74,3 +78,275 @@ class TestPublicClient(object):
         r = client.get_time()
         assert type(r) is dict
         assert 'iso' in r
+
+
+class TestPublicClientCache(object):
+
+    @pytest.fixture
+    def counting_client(self, monkeypatch):
+        c = PublicClient()
+        calls = []
+
+        def fake_send_message(method, endpoint, params=None, data=None):
+            calls.append(endpoint)
+            return [{'id': len(calls)}]
+        monkeypatch.setattr(c, '_send_message', fake_send_message)
+        c.calls = calls
+        return c
+
+    def test_get_products_is_cached(self, counting_client):
+        r1 = counting_client.get_products()
+        r1.append('mutated')
+        r2 = counting_client.get_products()
+        assert r2 == [{'id': 1}]
+        assert counting_client.calls == ['/products']
+
+    def test_clear_cache(self, counting_client):
+        counting_client.get_currencies()
+        counting_client.clear_cache()
+        counting_client.get_currencies()
+        assert counting_client.calls == ['/currencies', '/currencies']
+
+    def test_cache_disabled(self, counting_client):
+        counting_client.cache_ttl = 0
+        counting_client.get_products()
+        counting_client.get_products()
+        assert counting_client.calls == ['/products', '/products']
+
+
+class TestCandlesToNumpy(object):
+
+    def test_converts_rows(self):
+        np = pytest.importorskip('numpy')
+        r = _candles_to_numpy([[1415398768, 0.32, 4.2, 0.35, 4.2, 12.3],
+                               [1415398708, 0.3, 4.0, 0.3, 4.1, 1.5]])
+        assert r.shape == (2, 6)
+        assert r.dtype == np.float64
+        assert r[0, 0] == 1415398768
+
+    def test_empty(self):
+        pytest.importorskip('numpy')
+        assert _candles_to_numpy([]).shape == (0, 6)
+
+    def test_error_response_unchanged(self):
+        error = {'message': 'NotFound'}
+        assert _candles_to_numpy(error) is error
+
+
+class TestPaginationCursor(object):
+
+    def test_advance_updates_after(self):
+        params = {'limit': '50'}
+        cursor = PaginationCursor(params)
+        assert cursor.limit == 50
+        assert cursor.advance('123')
+        assert params['after'] == '123'
+
+    def test_stops_without_cursor(self):
+        cursor = PaginationCursor({})
+        assert cursor.limit is None
+        assert not cursor.advance(None)
+
+    def test_before_is_single_page(self):
+        params = {'before': '10'}
+        assert not PaginationCursor(params).advance('5')
+        assert 'after' not in params
+
+
+class TestConvertNumbers(object):
+
+    def test_ticker_to_float(self):
+        r = _convert_numbers({'trade_id': 4729088, 'price': '333.99',
+                              'size': '0.193', 'time': '2015-11-14'}, float)
+        assert r == {'trade_id': 4729088, 'price': 333.99, 'size': 0.193,
+                     'time': '2015-11-14'}
+
+    def test_trades_to_decimal(self):
+        r = _convert_numbers([{'price': '10.00000000', 'side': 'buy'}],
+                             Decimal)
+        assert r == [{'price': Decimal('10.00000000'), 'side': 'buy'}]
+
+    def test_order_book_levels(self):
+        r = _convert_numbers({'sequence': '3',
+                              'bids': [['295.96', '4.39088265', 2]],
+                              'asks': [['295.97', '25.23542881', 12]]},
+                             float)
+        assert r['sequence'] == '3'
+        assert r['bids'] == [[295.96, 4.39088265, 2]]
+        assert r['asks'] == [[295.97, 25.23542881, 12]]
+
+    def test_invalid_numeric_option(self):
+        with pytest.raises(ValueError):
+            PublicClient(numeric='int')
+
+
+class TestFetchProductTrades(object):
+
+    @pytest.fixture
+    def trades_client(self, monkeypatch):
+        c = PublicClient()
+        trades = [{'time': '2014-11-07T22:19:28.578544Z', 'trade_id': i,
+                   'price': '10.00000000', 'size': '0.01000000',
+                   'side': 'buy' if i % 2 else 'sell'}
+                  for i in range(250, 0, -1)]
+        monkeypatch.setattr(c, '_send_paginated_message',
+                            lambda endpoint, params=None, raise_errors=False:
+                            (t for t in trades))
+        return c
+
+    def test_truncates_to_available(self, trades_client):
+        r = trades_client.fetch_product_trades('BTC-USD', 1000)
+        assert type(r) is list
+        assert len(r) == 250
+
+    def test_stops_at_limit(self, trades_client):
+        r = trades_client.fetch_product_trades('BTC-USD', 10)
+        assert [t['trade_id'] for t in r] == list(range(250, 240, -1))
+
+    def test_as_numpy(self, trades_client):
+        pytest.importorskip('numpy')
+        r = trades_client.fetch_product_trades('BTC-USD', 10, as_numpy=True)
+        assert r.shape == (10,)
+        assert r['trade_id'][0] == 250
+        assert r['price'][0] == 10.0
+        assert r['side'][0] == 0
+
+
+class TestRequestWithRetry(object):
+
+    def test_429_is_retried_for_post(self, scripted_client, sleeps):
+        c = scripted_client((429, b'{"message": "slow down"}', {}),
+                            (200, b'{"id": 1}', {}))
+        assert c._send_message('post', '/orders', data='{}') == {'id': 1}
+        assert len(c.session.calls) == 2
+        assert len(sleeps) == 1
+
+    def test_5xx_is_not_retried_for_post(self, scripted_client, sleeps):
+        c = scripted_client((503, b'{"message": "unavailable"}', {}),
+                            (200, b'{"id": 1}', {}))
+        r = c._send_message('post', '/orders', data='{}')
+        assert r == {'message': 'unavailable'}
+        assert len(c.session.calls) == 1
+        assert sleeps == []
+
+    def test_5xx_is_retried_for_get(self, scripted_client, sleeps):
+        c = scripted_client((502, b'{"message": "bad gateway"}', {}),
+                            (200, b'{"iso": "x"}', {}))
+        assert c.get_time() == {'iso': 'x'}
+        assert len(c.session.calls) == 2
+
+    def test_last_response_returned_when_retries_exhausted(
+            self, scripted_client, sleeps):
+        c = scripted_client((503, b'{"message": "first"}', {}),
+                            (503, b'{"message": "last"}', {}),
+                            max_retries=1)
+        assert c.get_time() == {'message': 'last'}
+        assert len(c.session.calls) == 2
+
+    def test_other_4xx_is_not_retried(self, scripted_client, sleeps):
+        c = scripted_client((404, b'{"message": "NotFound"}', {}))
+        assert c.get_time() == {'message': 'NotFound'}
+        assert len(c.session.calls) == 1
+
+    def test_retry_after_is_honoured(self, scripted_client, sleeps):
+        c = scripted_client((429, b'{}', {'Retry-After': '2'}),
+                            (200, b'{"iso": "x"}', {}))
+        c.get_time()
+        assert sleeps == [2.0]
+
+    def test_backoff_without_retry_after(self, scripted_client, sleeps):
+        c = scripted_client((429, b'{}', {}), (429, b'{}', {}),
+                            (200, b'{"iso": "x"}', {}))
+        c.get_time()
+        assert 0.075 <= sleeps[0] <= 0.125
+        assert 0.15 <= sleeps[1] <= 0.25
+
+
+class TestPaginatedStreaming(object):
+
+    def test_pages_are_streamed(self, scripted_client):
+        pytest.importorskip('ijson')
+        c = scripted_client((200, b'[{"trade_id": 2}, {"trade_id": 1.5}]',
+                             {'cb-after': '1'}),
+                            (200, b'[{"trade_id": 1}]', {}), max_retries=0)
+        r = list(c._send_paginated_message('/products/BTC-USD/trades'))
+        assert r == [{'trade_id': 2}, {'trade_id': 1.5}, {'trade_id': 1}]
+        assert type(r[1]['trade_id']) is float
+        assert all(kw['stream'] for _, _, kw in c.session.calls)
+        assert c.session.calls[1][2]['params'] == {'after': '1'}
+
+    def test_error_page_is_not_dropped(self, scripted_client):
+        c = scripted_client((400, b'{"message": "product_id is required"}',
+                             {}), max_retries=0)
+        r = list(c._send_paginated_message('/fills'))
+        # Same as without ijson: the error object is decoded and iterated.
+        assert r == ['message']
+
+
+class TestRetryAndCircuitBreaker(object):
+
+    def test_retries_complete_before_breaker_trips(self, scripted_client,
+                                                   sleeps):
+        c = scripted_client((503, b'{"message": "down"}', {}))
+        # Each call uses all of its retries and returns the last response.
+        for call in range(5):
+            assert c.get_time() == {'message': 'down'}
+            assert len(c.session.calls) == 6 * (call + 1)
+        # Five failed calls open the circuit; no request is sent.
+        with pytest.raises(CircuitOpen):
+            c.get_time()
+        assert len(c.session.calls) == 30
+
+    def test_success_after_retry_keeps_circuit_closed(self, scripted_client,
+                                                      sleeps):
+        c = scripted_client((503, b'{}', {}), (503, b'{}', {}),
+                            (503, b'{}', {}), (503, b'{}', {}),
+                            (503, b'{}', {}), (200, b'{"iso": "x"}', {}))
+        for _ in range(10):
+            assert c.get_time() == {'iso': 'x'}
+
+    def test_network_errors_count_as_failures(self, scripted_client,
+                                              sleeps):
+        c = scripted_client()
+
+        class FailingSession(object):
+            def request(self, method, url, **kwargs):
+                raise requests.ConnectionError('unreachable')
+        c.session = FailingSession()
+        for _ in range(5):
+            with pytest.raises(requests.ConnectionError):
+                c.get_time()
+        with pytest.raises(CircuitOpen):
+            c.get_time()
+
+
+class TestFetchProductTradesRequests(object):
+
+    @pytest.mark.parametrize('limit,pages', [(10, 1), (100, 1), (150, 2),
+                                             (200, 2)])
+    def test_no_extra_page_is_requested(self, paging_client, limit, pages):
+        c = paging_client()
+        r = c.fetch_product_trades('BTC-USD', limit)
+        assert [t['trade_id'] for t in r] == list(range(1000, 1000 - limit,
+                                                        -1))
+        assert len(c.session.calls) == pages
+
+    def test_fewer_trades_than_limit(self, paging_client):
+        c = paging_client(top=120)
+        assert len(c.fetch_product_trades('BTC-USD', 500)) == 120
+
+    @pytest.mark.parametrize('limit', [0, -1])
+    def test_invalid_limit(self, paging_client, limit):
+        c = paging_client()
+        with pytest.raises(ValueError):
+            c.fetch_product_trades('BTC-USD', limit)
+        assert c.session.calls == []
+
+    @pytest.mark.parametrize('as_numpy', [False, True])
+    def test_error_response_raises(self, scripted_client, as_numpy):
+        if as_numpy:
+            pytest.importorskip('numpy')
+        c = scripted_client((404, b'{"message": "NotFound"}', {}))
+        with pytest.raises(requests.HTTPError, match='NotFound') as e:
+            c.fetch_product_trades('BTC-USD-X', 10, as_numpy=as_numpy)
+        assert e.value.response.status_code == 404
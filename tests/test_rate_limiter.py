@@ -0,0 +1,80 @@
+import pytest
+import time
+from cbpro.rate_limiter import (CircuitBreaker, CircuitOpen, TokenBucket,
+                                backoff_delay, parse_retry_after)
+
+
+class TestTokenBucket(object):
+
+    def test_burst_is_free(self):
+        bucket = TokenBucket(rate=3, capacity=6)
+        assert all(bucket.reserve() == 0 for _ in range(6))
+
+    def test_over_burst_waits(self):
+        bucket = TokenBucket(rate=2, capacity=1)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+        assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+    def test_try_acquire_never_goes_into_debt(self):
+        bucket = TokenBucket(rate=0.001, capacity=2)
+        assert bucket.try_acquire()
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+        bucket.refund()
+        assert bucket.try_acquire()
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
+        with pytest.raises(ValueError):
+            TokenBucket(capacity=0)
+
+
+class TestRetryHelpers(object):
+
+    @pytest.mark.parametrize('headers,expected', [
+        ({}, None),
+        ({'Retry-After': '2'}, 2.0),
+        ({'Retry-After': '-1'}, 0.0),
+        ({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 0.0),
+        ({'Retry-After': 'soon'}, None),
+    ])
+    def test_parse_retry_after(self, headers, expected):
+        assert parse_retry_after(headers) == expected
+
+    def test_backoff_delay(self):
+        for attempt in range(5):
+            delay = backoff_delay(attempt)
+            assert 0.075 * 2 ** attempt <= delay <= 0.125 * 2 ** attempt
+
+
+class TestCircuitBreaker(object):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_seconds=10)
+        breaker.record(False)
+        breaker.before_request()
+        breaker.record(False)
+        with pytest.raises(CircuitOpen):
+            breaker.before_request()
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_seconds=10)
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+        breaker.before_request()
+
+    def test_half_open_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0.05)
+        breaker.record(False)
+        with pytest.raises(CircuitOpen):
+            breaker.before_request()
+        time.sleep(0.06)
+        breaker.before_request()
+        # Only the trial request is let through.
+        with pytest.raises(CircuitOpen):
+            breaker.before_request()
+        breaker.record(True)
+        breaker.before_request()